@@ -7,7 +7,8 @@
 # * http://www.gnu.org/copyleft/gpl.txt
 #***********************************************************/
 
-__all__ = ["exact",
+__all__ = ["bohmian",
+           "exact",
            "heom",
            "tsh",
           ]
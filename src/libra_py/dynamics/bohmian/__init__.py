@@ -0,0 +1,11 @@
+#***********************************************************
+# * Copyright (C) 2023 Mohammad Shakiba, Alexey V. Akimov
+# * This file is distributed under the terms of the
+# * GNU General Public License as published by the
+# * Free Software Foundation; either version 3 of the
+# * License, or (at your option) any later version.
+# * http://www.gnu.org/copyleft/gpl.txt
+#***********************************************************/
+
+__all__ = ["compute",
+          ]
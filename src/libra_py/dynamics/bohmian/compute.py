@@ -0,0 +1,746 @@
+#*********************************************************************************
+#* Copyright (C) 2023 Mohammad Shakiba, Alexey V. Akimov
+#*
+#* This file is distributed under the terms of the GNU General Public License
+#* as published by the Free Software Foundation, either version 3 of
+#* the License, or (at your option) any later version.
+#* See the file LICENSE in the root directory of this distribution
+#* or <http://www.gnu.org/licenses/>.
+#***********************************************************************************
+"""
+.. module:: compute
+   :platform: Unix, Windows
+   :synopsis: This module implements Bohmian (quantum trajectory) dynamics with
+       the trajectory ensemble density represented by a sum of trajectory basis
+       functions (TBFs), using PyTorch autograd for the derivatives of the density
+
+       List of functions:
+           * rho_gaussian(q, Q, sigma)
+           * rho_lorentzian(q, Q, sigma)
+           * quantum_potential(Q, sigma, mass, tbf)
+           * quantum_potential_gaussian_analytic(Q, sigma, mass)
+           * quantum_potential_orginal(Q, sigma, mass, tbf)
+           * compute_derivatives(q, function, function_params)
+           * compute_derivatives_hess(q, function, function_params)
+           * init_variables(ntraj, opt)
+           * md(_params)
+
+.. moduleauthor:: Mohammad Shakiba, Alexey V. Akimov
+
+"""
+
+__author__ = "Mohammad Shakiba"
+__copyright__ = "Copyright 2023 Mohammad Shakiba, Alexey V. Akimov"
+__credits__ = ["Mohammad Shakiba", "Alexey V. Akimov"]
+__license__ = "GNU-3"
+__version__ = "1.0"
+__maintainer__ = "Mohammad Shakiba"
+__email__ = "mshakiba@buffalo.edu"
+__url__ = "https://quantum-dynamics-hub.github.io/libra/index.html"
+
+
+import os
+import sys
+import math
+import time
+
+import h5py
+import torch
+
+import util.libutil as comn
+
+# Hoisted so the hot kernel evaluations multiply by a plain Python float
+# instead of constructing (and sqrt-ing) a fresh tensor on every call
+_SQRT_2PI = math.sqrt(2.0 * math.pi)
+_LOG_SQRT_2PI = 0.5 * math.log(2.0 * math.pi)
+
+
+def _verlet_kick(p, f, dt):
+    """
+    The momentum half-update of the velocity-Verlet integrator, in place on
+    the (autograd-free) momentum buffer
+
+    """
+    p.add_(f, alpha=0.5 * dt)
+
+
+def _verlet_drift(q_buf, p, inv_mass, dt):
+    """
+    The position update of the velocity-Verlet integrator, in place on the
+    (autograd-free) position buffer
+
+    """
+    q_buf.addcmul_(p, inv_mass, value=dt)
+
+
+# The integrator updates are sequences of tiny pointwise kernels - let the
+# compiler fuse them and cut the per-step Python dispatch when available
+if hasattr(torch, "compile"):
+    _verlet_kick = torch.compile(_verlet_kick, dynamic=False)
+    _verlet_drift = torch.compile(_verlet_drift, dynamic=False)
+
+
+
+def rho_gaussian(q, Q, sigma, inv_sigma2=None):
+    """
+    Computes the trajectory ensemble density at a point `q` as a normalized
+    sum of multidimensional Gaussian kernels centered at the trajectory positions:
+
+    rho(q) = 1/ntraj * sum_k  prod_d  exp( -(q_d - Q_{k,d})^2 / (2*sigma_d^2) ) / (sigma_d * sqrt(2*pi))
+
+    The evaluation points may be batched: for `q` of shape (npts, ndof) the
+    kernels are evaluated over the whole (npts, ntraj, ndof) broadcast at once,
+    with no Python loop over the points.
+
+    The per-DOF factors are accumulated in log space and combined with
+    logsumexp over the kernels, so the product over the DOFs cannot underflow
+    for moderate ndof and the whole evaluation is a single fused-friendly pass.
+
+    Args:
+        q ( torch.Tensor(ndof) or torch.Tensor(npts, ndof) ): the point(s) at
+            which the density is evaluated
+        Q ( torch.Tensor(ntraj, ndof) ): positions of all trajectories - the kernel centers
+        sigma ( torch.Tensor(ndof) ): the Gaussian widths for each DOF
+        inv_sigma2 ( torch.Tensor(ndof) ): optional precomputed 1/sigma**2, so
+            repeated calls skip the division [ default: None ]
+
+    Returns:
+        torch.Tensor: the density at the point(s) `q` - a scalar or a (npts) tensor
+
+    """
+
+    ntraj = Q.shape[0]
+    if inv_sigma2 is None:
+        inv_sigma2 = 1.0 / sigma**2
+
+    dq = q.unsqueeze(-2) - Q  # (..., ntraj, ndof)
+    log_kern = torch.sum(-0.5 * dq**2 * inv_sigma2 - torch.log(sigma) - _LOG_SQRT_2PI, dim=-1)
+
+    return torch.exp(torch.logsumexp(log_kern, dim=-1)) / ntraj
+
+
+def rho_lorentzian(q, Q, sigma, sigma2=None):
+    """
+    Computes the trajectory ensemble density at a point `q` as a normalized
+    sum of multidimensional Lorentzian kernels centered at the trajectory positions:
+
+    rho(q) = 1/ntraj * sum_k  prod_d  (sigma_d/pi) / ( (q_d - Q_{k,d})^2 + sigma_d^2 )
+
+    As in `rho_gaussian`, the evaluation points may be batched - a (npts, ndof)
+    input `q` gives a (npts) tensor of densities in one broadcasted computation,
+    and the product over the DOFs is accumulated in log space to preserve the
+    numerical range.
+
+    Args:
+        q ( torch.Tensor(ndof) or torch.Tensor(npts, ndof) ): the point(s) at
+            which the density is evaluated
+        Q ( torch.Tensor(ntraj, ndof) ): positions of all trajectories - the kernel centers
+        sigma ( torch.Tensor(ndof) ): the Lorentzian half-widths for each DOF
+        sigma2 ( torch.Tensor(ndof) ): optional precomputed sigma**2 [ default: None ]
+
+    Returns:
+        torch.Tensor: the density at the point(s) `q` - a scalar or a (npts) tensor
+
+    """
+
+    ntraj = Q.shape[0]
+    if sigma2 is None:
+        sigma2 = sigma**2
+
+    dq = q.unsqueeze(-2) - Q  # (..., ntraj, ndof)
+    log_kern = torch.sum(torch.log(sigma) - torch.log(dq**2 + sigma2) - math.log(math.pi), dim=-1)
+
+    return torch.exp(torch.logsumexp(log_kern, dim=-1)) / ntraj
+
+
+def quantum_potential(Q, sigma, mass, tbf=rho_gaussian, hutchinson_samples=0, return_force=False):
+    """
+    Computes the total quantum potential of the trajectory ensemble:
+
+    U = sum_k sum_d  -1/(2*m_d) * [ rho''_{k,d}/(2*rho_k) - (rho'_{k,d})^2/(4*rho_k^2) ]
+
+    where rho_k = rho(Q_k) is the TBF density evaluated at the position of the k-th
+    trajectory and the primes denote the spatial derivatives of the density field
+    w.r.t. its evaluation point (not w.r.t. the kernel centers).
+
+    The density is evaluated at a query tensor that shares the values of Q but is
+    a separate node of the autograd graph, so the backward passes differentiate
+    w.r.t. the evaluation points only. The first derivatives are obtained in a
+    single backward pass over the summed density - exact, since each query point
+    only affects its own density value. The diagonal second derivatives for all
+    DOFs are obtained in a single batched backward pass (`is_grads_batched=True`)
+    rather than one `autograd.grad` call per DOF, so the autograd engine is
+    invoked only twice per evaluation.
+
+    Alternatively, for large ndof, the diagonal can be estimated stochastically
+    with the Bekas estimator, diag(H) ~ E[ v * Hv ] over Rademacher vectors v
+    (the diagonal analog of the Hutchinson trace estimator). This replaces the
+    exact computation by `hutchinson_samples` Hessian-vector products, so the
+    number of backward passes no longer grows with ndof. Both branches target
+    the diagonal of the same query-point Hessian - the sampling only adds
+    variance around the exact value, it does not change the estimated quantity.
+
+    Args:
+        Q ( torch.Tensor(ntraj, ndof) ): positions of all trajectories, requires grad
+        sigma ( torch.Tensor(ndof) ): the kernel widths for each DOF
+        mass ( torch.Tensor(1, ndof) ): the masses for each DOF
+        tbf ( PyObject ): the kernel density function - one of `rho_gaussian`
+            or `rho_lorentzian` [ default: rho_gaussian ]
+        hutchinson_samples ( int ): the number of Rademacher samples for the
+            stochastic estimation of the Hessian diagonal; 0 means compute the
+            diagonal exactly [ default: 0 ]
+        return_force ( Boolean ): whether to also return the force, -dU/dQ, on
+            all trajectories; the value and the force are then extracted from
+            the same graph with a single extra backward traversal, instead of
+            the caller re-deriving the force from a separate evaluation
+            [ default: False ]
+
+    Returns:
+        torch.Tensor: the scalar total quantum potential, differentiable w.r.t. Q;
+        if `return_force` is set - a tuple with the (detached) potential and the
+        (ntraj, ndof) force
+
+    """
+
+    ntraj, ndof = Q.shape
+
+    # The query points share the values of Q but form a separate node of the
+    # graph: differentiating w.r.t. `q` gives the spatial derivatives of the
+    # density field only, with no contamination from the dependence through the
+    # kernel centers. The centers stay connected to Q, so the force below still
+    # sees the full dependence.
+    q = Q.clone()
+
+    # All ntraj query points in one broadcasted kernel evaluation - no Python
+    # loop and no torch.stack of ntraj small graphs
+    f_list = tbf(q, Q, sigma)  # (ntraj)
+
+    # Exact per-query gradients: f_list[j] depends only on row j of `q`, so the
+    # backward pass over the sum does not mix the trajectories
+    grad_f = torch.autograd.grad(f_list.sum(), q, create_graph=True)[0]  # (ntraj, ndof)
+
+    if hutchinson_samples > 0:
+        # Bekas stochastic estimator: diag(H) ~ 1/k * sum_s v_s * (H v_s),
+        # one Hessian-vector product per Rademacher sample
+        deriv2 = torch.zeros_like(grad_f)
+        for _ in range(hutchinson_samples):
+            v = (torch.randint(0, 2, (ntraj, ndof), device=Q.device) * 2 - 1).to(Q.dtype)
+            Hv = torch.autograd.grad(grad_f, q, grad_outputs=v, retain_graph=True,
+                                     create_graph=True)[0]
+            deriv2 = deriv2 + v * Hv
+        deriv2 = deriv2 / hutchinson_samples
+    else:
+        # One batched backward pass for all the diagonal second derivatives:
+        # batch over the DOF index with one-hot grad_outputs. The query Hessian
+        # is block-diagonal across the trajectories, so the trajectory-summed
+        # rows are exactly the elementwise diagonal entries.
+        I = torch.eye(ndof, dtype=Q.dtype, device=Q.device)
+        I = I.unsqueeze(1).expand(ndof, ntraj, ndof)
+        deriv2 = torch.autograd.grad(grad_f, q, grad_outputs=I, is_grads_batched=True,
+                                     create_graph=True)[0]  # (ndof, ntraj, ndof)
+        deriv2 = torch.diagonal(deriv2, dim1=0, dim2=2)  # (ntraj, ndof)
+
+    rho = f_list.unsqueeze(1)  # (ntraj, 1)
+    U = torch.sum(-(0.5 / mass) * (deriv2 / (2.0 * rho) - grad_f**2 / (4.0 * rho**2)))
+
+    if not return_force:
+        return U
+
+    dU = torch.autograd.grad(U, Q)[0]
+    return U.detach(), -dU
+
+
+def quantum_potential_gaussian_analytic(Q, sigma, mass, return_force=False):
+    """
+    Computes the total quantum potential for the Gaussian TBF density using the
+    closed-form derivatives of the Gaussian kernel instead of autograd:
+
+    K_k(q) = prod_d exp( -(q_d - Q_{k,d})^2/(2*sigma_d^2) ) / (sigma_d*sqrt(2*pi))
+    dK/dq_d = -K * (q_d - Q_{k,d})/sigma_d^2
+    d2K/dq_d^2 = K * [ ((q_d - Q_{k,d})/sigma_d^2)^2 - 1/sigma_d^2 ]
+
+    All pairwise terms are evaluated in a single (ntraj, ntraj, ndof) broadcasted
+    computation, so there is no Python loop over the trajectories and no autograd
+    graph traversal - only plain tensor arithmetic.
+
+    This computes exactly the same quantity as `quantum_potential(Q, sigma, mass,
+    rho_gaussian)`: the spatial derivatives of the density field at the trajectory
+    positions, self-kernel (k = j) term included - rho = mean_k K, drho = mean_k
+    (-a*K), d2rho = mean_k ((a^2 - 1/sigma^2)*K) are the closed forms of the
+    query-point derivatives that the autograd path extracts with backward passes,
+    so the two functions agree to roundoff and `md` gets identical dynamics from
+    either.
+
+    With `return_force=True` the gradient of the quantum potential w.r.t. the
+    trajectory positions is also assembled analytically (the required third
+    derivatives of the Gaussian kernel are still closed form), so the force
+    costs a few extra tensor contractions instead of a backward pass. In this
+    mode everything runs under `torch.no_grad()` and the returned tensors are
+    detached.
+
+    Args:
+        Q ( torch.Tensor(ntraj, ndof) ): positions of all trajectories
+        sigma ( torch.Tensor(ndof) ): the Gaussian widths for each DOF
+        mass ( torch.Tensor(1, ndof) ): the masses for each DOF
+        return_force ( Boolean ): whether to also return the analytic force,
+            -dU/dQ, on all trajectories [ default: False ]
+
+    Returns:
+        torch.Tensor: the scalar total quantum potential; if `return_force`
+        is set - a tuple with the potential and the (ntraj, ndof) force
+
+    """
+
+    if not return_force:
+        return _qpot_gaussian(Q, sigma, mass)[0]
+
+    with torch.no_grad():
+        U, dU = _qpot_gaussian(Q, sigma, mass, do_force=True)
+    return U, -dU
+
+
+def _qpot_gaussian(Q, sigma, mass, do_force=False):
+    """
+    The working routine behind `quantum_potential_gaussian_analytic`: returns
+    the scalar quantum potential and, if `do_force` is set, its analytic
+    gradient dU/dQ of shape (ntraj, ndof)
+
+    """
+
+    ntraj = Q.shape[0]
+    inv_s2 = 1.0 / sigma**2
+
+    dq = Q.unsqueeze(1) - Q.unsqueeze(0)  # (ntraj, ntraj, ndof)
+    a = dq * inv_s2
+    w = torch.exp(-0.5 * dq * a) / (sigma * _SQRT_2PI)
+    K = w.prod(-1)  # (ntraj, ntraj)
+
+    rho = K.mean(1).unsqueeze(-1)  # (ntraj, 1)
+    drho = (-a * K.unsqueeze(-1)).mean(1)  # (ntraj, ndof)
+    d2rho = ((a**2 - inv_s2) * K.unsqueeze(-1)).mean(1)  # (ntraj, ndof)
+
+    c = -0.5 / mass  # (1, ndof)
+    U = torch.sum(c * (d2rho / (2.0 * rho) - drho**2 / (4.0 * rho**2)))
+
+    if not do_force:
+        return U, None
+
+    # dU/dQ[m,e] = sum_{j,d} [ alpha*d(d2rho) + beta*d(drho) ] + sum_j gamma*d(rho),
+    # where each derivative splits into an on-trajectory (j = m) part summed over
+    # the kernel index k, and a cross part where the moved trajectory m is the
+    # kernel center (k = m)
+    alpha = c / (2.0 * rho)  # (ntraj, ndof)
+    beta = -c * drho / (2.0 * rho**2)  # (ntraj, ndof)
+    gamma = (c * (-d2rho / (2.0 * rho**2) + drho**2 / (2.0 * rho**3))).sum(-1)  # (ntraj)
+
+    # d(rho_j)/dQ[m,e] = delta_jm*drho[j,e] + K[j,m]*a[j,m,e]/ntraj
+    t_rho = gamma.unsqueeze(-1) * drho \
+        + torch.einsum('j,jm,jme->me', gamma, K, a) / ntraj
+
+    # d(drho[j,d])/dQ[m,e] = (delta_jm - delta_km) * K * (a_d*a_e - delta_de/s_d^2)/ntraj
+    ba = torch.einsum('jd,jkd->jk', beta, a)
+    t_drho = (torch.einsum('mk,mke->me', K * ba, a)
+              - K.sum(1).unsqueeze(-1) * beta * inv_s2) / ntraj \
+        + (torch.einsum('jm,je->me', K, beta) * inv_s2
+           - torch.einsum('jm,jme->me', K * ba, a)) / ntraj
+
+    # d(d2rho[j,d])/dQ[m,e] = (delta_jm - delta_km) * K * [ 2*a_d*delta_de/s_d^2
+    #                                                       - (a_d^2 - 1/s_d^2)*a_e ]/ntraj
+    aa = torch.einsum('jd,jkd->jk', alpha, a**2 - inv_s2)
+    t_d2rho = (2.0 * alpha * inv_s2 * torch.einsum('mk,mke->me', K, a)
+               - torch.einsum('mk,mke->me', K * aa, a)) / ntraj \
+        - (2.0 * inv_s2 * torch.einsum('jm,je,jme->me', K, alpha, a)
+           - torch.einsum('jm,jme->me', K * aa, a)) / ntraj
+
+    return U, t_d2rho + t_drho + t_rho
+
+
+def quantum_potential_orginal(Q, sigma, mass, tbf=rho_gaussian):
+    """
+    The per-trajectory reference implementation of the quantum potential: the
+    trajectories are processed one by one, with one `torch.autograd.grad` call
+    for the gradient and one per DOF for the diagonal second derivatives of
+    each trajectory - O(ntraj*(1+ndof)) autograd invocations per evaluation.
+
+    It computes the same quantity as the vectorized `quantum_potential` - the
+    spatial derivatives of the density field at each trajectory position,
+    obtained by differentiating w.r.t. a separate query point - and is kept as
+    the slow, obviously-correct reference for validating the batched path.
+    Production code should use `quantum_potential`.
+
+    Args: same as in `quantum_potential`
+
+    Returns:
+        torch.Tensor: the scalar total quantum potential, differentiable w.r.t. Q
+
+    """
+
+    ntraj, ndof = Q.shape
+    U = 0.0
+
+    for k in range(ntraj):
+        q = Q[k].clone()  # the query point of the density field for trajectory k
+        f = tbf(q, Q, sigma)
+        grad = torch.autograd.grad(f, q, create_graph=True)[0]  # (ndof)
+
+        for d in range(ndof):
+            deriv2 = torch.autograd.grad(grad[d], q, retain_graph=True,
+                                         create_graph=True)[0][d]
+            U = U - (0.5 / mass[0, d]) * (deriv2 / (2.0 * f) - grad[d]**2 / (4.0 * f**2))
+
+    return U
+
+
+def compute_derivatives(q, function, function_params):
+    """
+    Computes the value of the classical potential and its gradient w.r.t. the
+    trajectory positions
+
+    When `torch.func` is available, the potential and its gradient are evaluated
+    per trajectory with `vmap(grad_and_value(...))`, so each row of the batch is
+    differentiated independently instead of assembling and traversing one joint
+    autograd graph. This requires `function` to be vmap-compatible (pure, no
+    mixing across the batch dimension); older PyTorch falls back to the joint
+    autograd path.
+
+    Args:
+        q ( torch.Tensor(ntraj, ndof) ): positions of all trajectories, requires grad
+        function ( PyObject ): the potential function - takes `q` and the
+            parameters dictionary, returns a (ntraj) tensor of per-trajectory energies
+        function_params ( dictionary ): the parameters of the potential function
+
+    Returns:
+        (torch.Tensor, torch.Tensor(ntraj, ndof)): (f, grad), where:
+
+            * f - the total potential energy of the ensemble
+            * grad - the gradient of `f` w.r.t. `q`
+
+    """
+
+    try:
+        from torch.func import grad_and_value, vmap
+    except ImportError:
+        f = function(q, function_params).sum()
+        grad = torch.autograd.grad(f, q, create_graph=True)[0]
+        return f, grad
+
+    per_traj = grad_and_value(lambda qi: function(qi.unsqueeze(0), function_params).squeeze())
+    grad, f = vmap(per_traj)(q)
+
+    return f.sum(), grad
+
+
+def compute_derivatives_hess(q, function, function_params):
+    """
+    Computes the value, the gradient, and the per-trajectory Hessian of the
+    classical potential w.r.t. the trajectory positions
+
+    Args: same as in `compute_derivatives`
+
+    Returns:
+        (torch.Tensor, torch.Tensor(ntraj, ndof), torch.Tensor(ntraj, ndof, ndof)):
+        (f, grad, hess), where:
+
+            * f - the total potential energy of the ensemble
+            * grad - the gradient of `f` w.r.t. `q`
+            * hess - the Hessian blocks of each trajectory
+
+    """
+
+    ntraj, ndof = q.shape
+
+    # The higher derivatives here need the joint autograd graph, so the forward
+    # pass is done directly rather than through compute_derivatives (whose vmap
+    # path returns gradients detached from `q`)
+    f = function(q, function_params).sum()
+    grad = torch.autograd.grad(f, q, create_graph=True)[0]
+
+    # All ntraj*ndof Hessian rows in one batched backward pass instead of a
+    # nested Python loop with one autograd.grad call per (trajectory, DOF)
+    I = torch.eye(ntraj * ndof, dtype=q.dtype, device=q.device).view(ntraj * ndof, ntraj, ndof)
+    hess = torch.autograd.grad(grad, q, grad_outputs=I, is_grads_batched=True,
+                               retain_graph=True)[0]  # (ntraj*ndof, ntraj, ndof)
+    hess = hess.view(ntraj, ndof, ntraj, ndof)
+    hess = torch.diagonal(hess, dim1=0, dim2=2).permute(2, 0, 1)  # (ntraj, ndof, ndof)
+
+    return f, grad, hess
+
+
+def init_variables(ntraj, opt=1, device=None):
+    """
+    Samples the initial positions and momenta of the trajectory ensemble for
+    the 2D Eckart barrier scattering setups
+
+    Args:
+        ntraj ( int ): the number of trajectories
+        opt ( int ): selection of the initial momentum:
+
+            - 1: p0 = 3.0 a.u. - below-barrier incidence [ default ]
+            - 2: p0 = 4.0 a.u. - above-barrier incidence
+
+        device ( string ): the device to create the tensors on; None picks
+            "cuda" when available and falls back to "cpu" [ default: None ]
+
+    Returns:
+        (torch.Tensor(ntraj, 2), torch.Tensor(ntraj, 2), torch.Tensor(1, 2)):
+        (q, p, masses) - the initial positions, momenta, and the masses
+
+    """
+
+    mass = 2000.0
+
+    p0 = 3.0
+    if opt == 2:
+        p0 = 4.0
+
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    # The means/widths are identical across the trajectories, so sample a
+    # standard normal batch and shift/scale it instead of replicating
+    # length-ntraj Python lists for torch.normal
+    q = torch.tensor([-1.0, 0.0], device=device) \
+        + torch.tensor([0.04, 0.04], device=device) * torch.randn(ntraj, 2, device=device)
+    p = torch.tensor([p0, 0.0], device=device) \
+        + torch.tensor([0.0, 0.0], device=device) * torch.randn(ntraj, 2, device=device)
+    masses = torch.full((1, 2), mass, device=device)
+
+    return q, p, masses
+
+
+def md(_params):
+    """
+    Runs the velocity-Verlet molecular dynamics of the trajectory ensemble
+    on the classical potential, optionally augmented with the Bohmian quantum
+    potential computed from the TBF density
+
+    Args:
+        _params ( dictionary ): the parameters controlling the simulation
+
+            * **_params["q"]** ( torch.Tensor(ntraj, ndof) ): initial positions [ Required ]
+            * **_params["p"]** ( torch.Tensor(ntraj, ndof) ): initial momenta [ Required ]
+            * **_params["masses"]** ( torch.Tensor(1, ndof) ): the masses [ Required ]
+            * **_params["potential"]** ( PyObject ): the classical potential function [ Required ]
+            * **_params["potential_params"]** ( dictionary ): the parameters of the potential [ Required ]
+            * **_params["nsteps"]** ( int ): how many MD steps to do [ default: 1000 ]
+            * **_params["dt"]** ( double ): the integration timestep, a.u. [ default: 1.0 ]
+            * **_params["sigma"]** ( double ): the TBF kernel width [ default: 0.1 ]
+            * **_params["do_bohmian"]** ( int ): whether to add the quantum potential:
+              0 - classical trajectories, 1 - Bohmian trajectories [ default: 1 ]
+            * **_params["tbf_type"]** ( string ): the kernel type - "gaussian" or
+              "lorentzian" [ default: "gaussian" ]
+            * **_params["hutchinson_samples"]** ( int ): the number of Rademacher
+              samples for the stochastic estimation of the Hessian diagonal in
+              `quantum_potential`; 0 computes the diagonal exactly; only in
+              effect for the autograd (non-Gaussian) kernels [ default: 0 ]
+            * **_params["device"]** ( string ): the device to run the dynamics
+              on; None picks "cuda" when available and falls back to "cpu".
+              Everything stays on that device during the run - only the
+              snapshots and the final E/P/t move to the host [ default: None ]
+            * **_params["dtype"]** ( torch.dtype ): the dtype to run the dynamics
+              in; None keeps the dtype of the input tensors [ default: None ]
+            * **_params["n_pool"]** ( int ): the number of worker processes to
+              split the ensemble over; only used when do_bohmian is 0 (with the
+              quantum potential the trajectories are coupled through the
+              density and cannot be partitioned) [ default: 1 ]
+            * **_params["storage_dtype"]** ( torch.dtype ): the dtype of the
+              q_traj/p_traj snapshot buffers - e.g. torch.float32 or
+              torch.bfloat16 to halve the memory traffic of the dominant
+              storage tensors while the dynamics itself stays in a wider type;
+              None matches the working dtype [ default: None ]
+            * **_params["print_period"]** ( int ): how often (in steps) to print the
+              summary of the properties [ default: 100 ]
+            * **_params["prefix"]** ( string ): the name prefix of the file to save
+              the results to [ default: "md" ]
+
+    Returns:
+        (torch.Tensor(nsteps, 3), torch.Tensor(nsteps)): (E, P), where:
+
+            * E - kinetic, potential, and total energies at all timesteps
+            * P - the transmission probability at all timesteps
+
+        The position/momentum snapshots (every `print_period` steps) are
+        streamed to the resizable "q_traj"/"p_traj" datasets of
+        "{prefix}.h5" while the dynamics runs (one file per worker for
+        pooled runs), so the full (nsnaps, ntraj, ndof) history is never
+        held in memory; E, P, and t are saved to "{prefix}.pt"
+
+    """
+
+    params = dict(_params)
+
+    critical_params = ["q", "p", "masses", "potential", "potential_params"]
+    default_params = {"nsteps": 1000, "dt": 1.0, "sigma": 0.1, "do_bohmian": 1,
+                      "tbf_type": "gaussian", "hutchinson_samples": 0,
+                      "dtype": None, "storage_dtype": None, "device": None, "n_pool": 1,
+                      "print_period": 100, "prefix": "md"}
+    comn.check_input(params, default_params, critical_params)
+
+    prefix = params["prefix"]
+
+    if params["n_pool"] > 1 and params["do_bohmian"] == 0:
+        # Without the quantum potential the trajectories are fully independent,
+        # so split the ensemble and run the chunks on separate cores
+        import torch.multiprocessing as mp
+
+        n_pool = params["n_pool"]
+        q_chunks = torch.chunk(params["q"], n_pool, dim=0)
+        p_chunks = torch.chunk(params["p"], n_pool, dim=0)
+
+        chunk_params = []
+        for ichunk in range(len(q_chunks)):
+            pars = dict(params)
+            pars["q"] = q_chunks[ichunk]
+            pars["p"] = p_chunks[ichunk]
+            pars["prefix"] = F"{prefix}_pool{ichunk}"
+            chunk_params.append(pars)
+
+        with mp.Pool(n_pool) as pool:
+            res = pool.map(_md_serial, chunk_params)
+
+        E = sum(r[0] for r in res)
+        # the chunk sizes can differ by one, so weight each chunk's
+        # transmission probability by its number of trajectories
+        ntraj = params["q"].shape[0]
+        P = sum(r[1] * qc.shape[0] for r, qc in zip(res, q_chunks)) / ntraj
+        t = res[0][2]
+    else:
+        E, P, t = _md_serial(params)
+
+    torch.save({"t": t.cpu(), "E": E.cpu(), "P": P.cpu()}, F"{prefix}.pt")
+
+    return E, P
+
+
+def _md_serial(params):
+    """
+    The single-process MD driver behind `md`: integrates the (already
+    validated) parameter set, streaming the position/momentum snapshots to the
+    resizable "q_traj"/"p_traj" datasets of "{params['prefix']}.h5" as it runs,
+    and returns (E, P, t) - the per-step energies, transmission probabilities,
+    and times, still on the integration device. Saving E/P/t to disk is left
+    to the caller.
+
+    """
+
+    p = params["p"]
+    mass_mat = params["masses"]
+    potential = params["potential"]
+    potential_params = params["potential_params"]
+    nsteps = params["nsteps"]
+    dt = params["dt"]
+    do_bohmian = params["do_bohmian"]
+    hutchinson_samples = params["hutchinson_samples"]
+    print_period = params["print_period"]
+
+    ntraj, ndof = params["q"].shape
+    sigma = params["sigma"] * torch.ones(ndof)
+
+    tbf = rho_gaussian
+    if params["tbf_type"] == "lorentzian":
+        tbf = rho_lorentzian
+
+    def quantum_force(q):
+        # For the Gaussian kernel both the quantum potential and the force on
+        # the trajectories are closed form - the same quantity the autograd
+        # path computes, just with no backward pass at all; the other kernels
+        # go through autograd
+        if params["tbf_type"] == "gaussian":
+            return quantum_potential_gaussian_analytic(q, sigma, mass_mat, return_force=True)
+        return quantum_potential(q, sigma, mass_mat, tbf, hutchinson_samples,
+                                 return_force=True)
+
+    device = params["device"]
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    q = params["q"].clone().to(device)
+    p = p.clone().to(device)
+    mass_mat = mass_mat.to(device)
+    sigma = sigma.to(device)
+    if params["dtype"] is not None:
+        q = q.to(params["dtype"])
+        p = p.to(params["dtype"])
+        mass_mat = mass_mat.to(params["dtype"])
+        sigma = sigma.to(params["dtype"])
+
+    # The integrator runs in place on plain buffers; `q` is re-attached to
+    # autograd as a fresh leaf each step, so only one allocation per step
+    # remains (the clone backing that leaf)
+    q_buf = q.clone()
+    q.requires_grad_(True)
+
+    storage_dtype = params["storage_dtype"]
+    if storage_dtype is None:
+        storage_dtype = q.dtype
+
+    # Hoisted out of the step loop - the integrator and the kinetic energy
+    # then multiply instead of dividing nsteps times
+    inv_mass = 1.0 / mass_mat
+
+    # Snapshots go straight to resizable datasets on disk, so the resident
+    # trajectory storage is one frame regardless of nsteps
+    probe = torch.empty(0, dtype=storage_dtype)
+    if probe.dtype == torch.bfloat16:
+        probe = probe.float()
+    np_dtype = probe.numpy().dtype
+
+    f5 = h5py.File(F"{params['prefix']}.h5", "w")
+    q_dset = f5.create_dataset("q_traj", (0, ntraj, ndof), maxshape=(None, ntraj, ndof),
+                               dtype=np_dtype, chunks=(1, ntraj, ndof))
+    p_dset = f5.create_dataset("p_traj", (0, ntraj, ndof), maxshape=(None, ntraj, ndof),
+                               dtype=np_dtype, chunks=(1, ntraj, ndof))
+
+    E = torch.empty(nsteps, 3, device=q.device, dtype=q.dtype)
+    P = torch.empty(nsteps, device=q.device, dtype=q.dtype)
+    t = torch.empty(nsteps, device=q.device, dtype=q.dtype)
+
+    f, grad = compute_derivatives(q, potential, potential_params)
+    force = -grad
+    q_pot = torch.zeros(1)
+    if do_bohmian == 1:
+        q_pot, q_force = quantum_force(q)
+        force = force + q_force
+
+    for i in range(nsteps):
+
+        _verlet_kick(p, force.detach(), dt)
+        _verlet_drift(q_buf, p, inv_mass, dt)
+        q = q_buf.clone().requires_grad_(True)
+
+        f, grad = compute_derivatives(q, potential, potential_params)
+        force = -grad
+        if do_bohmian == 1:
+            q_pot, q_force = quantum_force(q)
+            force = force + q_force
+
+        _verlet_kick(p, force.detach(), dt)
+
+        t[i] = i * dt
+
+        # E, P, and t stay on the device - no .item()/printing here, so no
+        # forced host synchronization in the hot loop
+        ekin = torch.sum(0.5 * p * p * inv_mass)
+        epot = f.detach() + q_pot.detach().sum()
+        E[i, 0] = ekin
+        E[i, 1] = epot
+        E[i, 2] = ekin + epot
+
+        P[i] = (q[:, 0].detach() > 0).to(q.dtype).mean()
+
+        if i % print_period == 0:
+            isnap = i // print_period
+            q_snap = q.detach().to(storage_dtype)
+            p_snap = p.detach().to(storage_dtype)
+            if q_snap.dtype == torch.bfloat16:
+                q_snap = q_snap.float()
+                p_snap = p_snap.float()
+            q_dset.resize(isnap + 1, axis=0)
+            p_dset.resize(isnap + 1, axis=0)
+            q_dset[isnap] = q_snap.cpu().numpy()
+            p_dset[isnap] = p_snap.cpu().numpy()
+            print(F"step= {i} Ekin= {E[i,0]:.8f} Epot= {E[i,1]:.8f} Etot= {E[i,2]:.8f} P= {P[i]:.5f}")
+
+    f5.close()
+
+    return E, P, t
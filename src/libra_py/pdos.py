@@ -19,17 +19,69 @@
 
 """
 
+import glob
 import math
 import os
+import re
 import sys
 if sys.platform=="cygwin":
     from cyglibra_core import *
 elif sys.platform=="linux" or sys.platform=="linux2":
     from liblibra_core import *
 from . import units
+from . import data_conv
 import numpy as np
 
-def convolve(X0, Y0, dx0, dx, var):
+try:
+    from numba import njit, prange, get_num_threads, get_thread_id
+    _have_numba = True
+except ImportError:
+    _have_numba = False
+
+
+def _bin_add_np(energies, values, emin, emax, de, N):
+    """
+    Sums `values` into an N-point histogram binned by the energy of each point,
+    keeping only the points with energies within [emin, emax]. This is the plain
+    NumPy version, used when Numba is not available.
+    """
+
+    mask = (energies >= emin) & (energies <= emax)
+    idx = ((energies[mask] - emin)/de).astype(np.intp)
+
+    # a point exactly at emax can round up past the last bin edge when
+    # (emax - emin)/de lands on an integer - keep it in the last bin
+    np.minimum(idx, N - 1, out=idx)
+
+    return np.bincount(idx, weights=values[mask], minlength=N)
+
+
+if _have_numba:
+
+    @njit(parallel=True)
+    def _bin_add(energies, values, emin, emax, de, N):
+        """
+        Same as :func:`_bin_add_np`, but as a parallel native kernel: the index
+        computation is fused with the add, and each thread accumulates into its
+        own partial histogram, merged at the end.
+        """
+
+        nthreads = get_num_threads()
+        partial = np.zeros((nthreads, N))
+
+        for i in prange(energies.shape[0]):
+            e = energies[i]
+            if (e >= emin) and (e <= emax):
+                idx = min(int((e - emin)/de), N - 1)  # keep a point at emax in the last bin
+                partial[get_thread_id(), idx] += values[i]
+
+        return partial.sum(axis=0)
+
+else:
+    _bin_add = _bin_add_np
+
+
+def convolve(X0, Y0, dx0, dx, var, method=0, truncate=4.0):
     """
     This function convolves the original data with the Gaussian
     of a given width:  exp(- (x - x0)^2 / (2*var^2) )
@@ -43,6 +95,16 @@ def convolve(X0, Y0, dx0, dx, var):
         dx0 ( double ): original X grid spacing [in units of energy]
         dx ( double ): new X grid spacing [in units of energy]
         var ( double ): width of the Gaussians that broaden the original data [in units of energy]
+        method ( int ): selects how the broadening is computed [ default: 0 ]
+
+            - 0: explicit Gaussian kernel matrix - exact for any grid
+            - 1: `scipy.ndimage.gaussian_filter1d` applied to the original points
+              placed onto the dense grid - an optimized separable filter that
+              truncates the kernel at `truncate` standard deviations, so it only
+              does O(N * var/dx) work instead of O(N * N0)
+
+        truncate ( double ): where to truncate the filter kernel, in units of the
+            Gaussian width, in effect only if method == 1 [ default: 4.0 ]
 
     Returns:
         tuple: ( X, Y ), where:
@@ -57,42 +119,189 @@ def convolve(X0, Y0, dx0, dx, var):
     print("original grid spacing = ", dx0)
     print("new grid spacing = ", dx)
     print("gaussian variance = ", var)
-        
+
     # Prepare arrays
     N0    = Y0.num_of_rows     # how many original grid points
     nproj = Y0.num_of_cols     # how many components
     N  = N0*mult               # how many new grid points
 
-    X = MATRIX(N, 1)           # new X axis
-    Y = MATRIX(N, nproj)       # new Y axes
+    x0 = np.array([X0.get(i, 0) for i in range(0, N0)])   # original grid
+    x = X0.get(0, 0) + dx*np.arange(N)                    # new, denser grid
 
+    area = var*math.sqrt(2.0*math.pi)  # area under Gaussian of type exp( -(x - x0)^2 / 2*var^2 )
+    alp = 0.5/(var**2)
 
-    for i in range(0,N):
-        X.set(i,0, X0.get(0,0) + i*dx)
+    Y0_np = data_conv.MATRIX2nparray(Y0)   # converted once, used by both methods
 
+    if method == 1:
+        from scipy.ndimage import gaussian_filter1d
 
-    area = var*math.sqrt(2.0*math.pi)  # area under Gaussian of type exp( -(x - x0)^2 / 2*var^2 ) 
-    alp = 0.5/(var**2)
+        # The original points coincide with every mult-th point of the dense grid,
+        # so place them there as impulses of weight dx0*y0/dx and let the
+        # unit-normalized filter kernel (height ~ dx/area) spread them out
+        up = np.zeros((N, nproj))
+        up[::mult, :] = Y0_np * (dx0/dx)
+        Ynp = gaussian_filter1d(up, sigma=var/dx, axis=0, truncate=truncate, mode='constant')
 
-    for j in range(0,nproj):  
+    else:
+        # Each original point contributes a Gaussian scaled by its area, dx0*y0/area.
+        # All the normalization is folded into these weights once, so the kernel
+        # tiles below are pure exponentials
+        W = Y0_np * (dx0/area)   # N0 x nproj
+
+        # Beyond ~6 sigma the Gaussian is below 1e-8 of its peak, so a grid point
+        # only receives contributions from the original points within that window
+        cutoff = 6.0*var
+
+        # Process the new grid in tiles: each tile's kernel matrix against the
+        # original points within reach stays cache-resident, instead of
+        # materializing the full N x N0 pairwise matrix at once
+        tile = 2048
+
+        Ynp = np.zeros((N, nproj))
+        for i in range(0, N, tile):
+            xt = x[i:i+tile]
+            j1 = np.searchsorted(x0, xt[0] - cutoff)
+            j2 = np.searchsorted(x0, xt[-1] + cutoff)
+            if j1 < j2:
+                d = xt[:, None] - x0[None, j1:j2]
+                Ynp[i:i+tile, :] = np.exp(-alp*d*d).dot(W[j1:j2, :])
+
+    X = data_conv.nparray2MATRIX(x.reshape(N, 1))
+    Y = data_conv.nparray2MATRIX(Ynp)
 
-        for i0 in range(0,N0):   # all initial grid points
-            x0 = X0.get(i0, 0)
-            y0 = Y0.get(i0, j)
+    return X, Y
 
-            area0 = dx0*y0      # initial area
-            w = area0/area
 
-            for i in range(0,N):
-                x = X.get(i, 0)
-                Y.add(i,j, w*math.exp(-alp*(x0-x)**2))
 
-    return X, Y
 
+# A single-entry cache of the Gaussian bank used by convolve_cp2k_pdos: in MD
+# workflows the function runs once per time step with the same levels, grid and
+# broadening but different weights, so the exp evaluations can be reused
+_cp2k_gaussian_bank = { "key": None, "grid": None, "bank": None }
+
+
+def convolve_cp2k_pdos(cp2k_pdos_file, sigma, npoints, energy_conversion, angular_momentum_cols, single_precision=False):
+    """
+    This function reads a .pdos file produced by CP2K and broadens each of the
+    discrete energy levels with a Gaussian of a given width, summing up the
+    angular momentum components requested for each projection
+
+    Args:
+        cp2k_pdos_file ( string ): the name of the .pdos file produced by CP2K
+        sigma ( double ): the standard deviation of the broadening Gaussians
+            [in the units of the converted energies]
+        npoints ( int ): the number of points of the output energy grid
+        energy_conversion ( double ): the conversion factor applied to the level
+            energies, e.g. units.au2ev to get the pDOS in eV
+        angular_momentum_cols ( list of lists of ints ): for each projection, the
+            columns of the .pdos file to sum over, e.g. [[3], [4,5,6]] for s and p.
+            Columns count from 0: column 1 is the level energy, column 2 is its
+            occupation, the orbital populations start at column 3
+        single_precision ( Bool ): whether to evaluate the broadening Gaussians in
+            float32 - this halves the memory traffic and is far more accurate than
+            the broadening itself, the result is returned in float64 either way
+            [ default: False ]
+
+    Returns:
+        tuple: ( energy_grid, convolved_pdos ), where:
+
+            * energy_grid ( np.array(npoints) ): the energy grid [in the units of the converted energies]
+            * convolved_pdos ( np.array(npoints, Nproj) ): the broadened pDOS of each projection,
+                Nproj = len(angular_momentum_cols)
+
+    """
+
+    # The first two lines are the headers, the rest hold one energy level per
+    # line - parse them all at once with the C-level tokenizer
+    energy_lines = np.loadtxt(cp2k_pdos_file, skiprows=2, ndmin=2)
+    num_levels = energy_lines.shape[0]
+    num_cols = energy_lines.shape[1]
+
+    nproj = len(angular_momentum_cols)
+
+    # Sum up the angular momentum components of each level for each projection -
+    # a contiguous column slice and one vectorized sum per projection
+    centers = energy_lines[:, 1]*energy_conversion                            # num_levels
+    W = np.stack([ energy_lines[:, [c for c in cols if c < num_cols]].sum(axis=1)
+                   for cols in angular_momentum_cols ], axis=1)               # num_levels x nproj
+
+    dtype = np.float32 if single_precision else np.float64
+
+    # The Gaussian normalization is folded into the weights - one multiply per
+    # level and projection, rather than one per kernel element
+    pre_factor = 1.0/(sigma*math.sqrt(2.0*math.pi))
+    Wd = W.astype(dtype)*dtype(pre_factor)
+
+    # The Gaussian bank only depends on the levels, the grid and the broadening -
+    # reuse it from the cache when they repeat across calls (e.g. over an MD
+    # trajectory with a fixed file layout)
+    key = (centers.tobytes(), npoints, sigma, dtype)
+
+    if _cp2k_gaussian_bank["key"] == key:
+        energy_grid = _cp2k_gaussian_bank["grid"]
+        bank = _cp2k_gaussian_bank["bank"]
+
+    else:
+        # The energy grid covers all the levels, with a margin for the broadening tails
+        energy_grid = np.linspace(centers.min() - 10.0*sigma, centers.max() + 10.0*sigma, npoints)
+
+        # Each level only contributes within ~6 sigma of its center, so evaluate
+        # the Gaussians on those windows only instead of over the whole grid
+        grid = energy_grid.astype(dtype)
+        cen = centers.astype(dtype)
+        sigma_d = dtype(sigma)
+        cutoff = 6.0*sigma
+
+        bank = []
+        for i in range(0, num_levels):
+            i1 = np.searchsorted(grid, cen[i] - cutoff)
+            i2 = np.searchsorted(grid, cen[i] + cutoff)
+            t = (grid[i1:i2] - cen[i])/sigma_d
+            bank.append( (i1, np.exp(-0.5*t*t)) )
+
+        _cp2k_gaussian_bank["key"] = key
+        _cp2k_gaussian_bank["grid"] = energy_grid
+        _cp2k_gaussian_bank["bank"] = bank
+
+    convolved_pdos = np.zeros((npoints, nproj), dtype=dtype)
+    for i in range(0, num_levels):
+        i1, g = bank[i]
+        convolved_pdos[i1:i1+g.shape[0], :] += np.outer(g, Wd[i, :])
+
+    if single_precision:
+        convolved_pdos = convolved_pdos.astype(np.float64)
+
+    return energy_grid, convolved_pdos
+
+
+
+
+def _QE_pdos_file(filename, emin, emax, de, N, nspin):
+    """
+    Parses one QE projection file and bins it on the energy grid.
+    Returns the (alpha, beta) histograms; beta is None unless this is a
+    spin-polarized file. This is a module-level function so that QE_pdos can
+    also run it through a process pool.
+    """
 
+    data = np.loadtxt(filename, skiprows=1, ndmin=2)  # skip the header
 
+    dos_a = _bin_add(data[:, 0], data[:, 1], emin, emax, de, N)
 
-def QE_pdos(prefix, emin, emax, de, projections, Ef, outfile_prefix, do_convolve, de_new, var, nspin=1):
+    dos_b = None
+    if nspin == 2:
+        fa = open(filename,"r")
+        check = fa.readline().split()    # the header
+        fa.close()
+
+        if check[4] == "ldosdw(E)":
+            dos_b = _bin_add(data[:, 0], data[:, 2], emin, emax, de, N)
+
+    return dos_a, dos_b
+
+
+def QE_pdos(prefix, emin, emax, de, projections, Ef, outfile_prefix, do_convolve, de_new, var, nspin=1, nprocs=1):
     """Computes various types of pDOS from the atomic state projections generated by the QE
 
     Args:
@@ -113,17 +322,20 @@ def QE_pdos(prefix, emin, emax, de, projections, Ef, outfile_prefix, do_convolve
         var ( double ): standard deviation of the Gaussian [eV] with which we do a convolution, 
             in effect only if do_convolve == True
         nspin ( int): specifies which nspin was used in the electronic structure calculation.
-                      nspin = 1      
+                      nspin = 1
                       nspin = 2
                       nspin = 4
+        nprocs ( int ): how many processes to use for parsing the projection files;
+            the parsing is independent per file, so it parallelizes trivially,
+            while the accumulation stays on the main process [ default: 1 ]
 
     Returns:
         tuple: ( E, pDOSa ), where:
 
             * E ( MATRIX(N, 1) ): new energy grid, N - the new number of energy grid points
             * pDOSa ( MATRIX(N, Nproj) ): new Y grids, Nproj - len(projections) the number of projections we are interested in
-            * if spin = 2, returns pDOSb for beta spin-orbtials as well
-            * if spin = 4, returns just the pDOSa (pDOSb = None), but the orbitals now mixed spin states 
+            * if spin = 2, returns pDOSb for beta spin-orbtials as well; for the other nspin
+              values pDOSb is None (for nspin = 4 the orbitals are mixed spin states anyways)
     """
 
     if nspin not in [1,2,4]:
@@ -139,106 +351,92 @@ def QE_pdos(prefix, emin, emax, de, projections, Ef, outfile_prefix, do_convolve
     nproj = len(projections)                # number of projections
     N = int(math.floor((emax - emin)/de))+1 # number of the gridpoints
 
-    en   = MATRIX(N, 1)      # energy of the grid points
-    dosa = MATRIX(N, nproj)  # Matrix for alpha spin-orbitals dos.get(i,proj) - dos for level i projected on projection proj
-    dosb = MATRIX(N, nproj)  # Matrix for beta  spin-orbitals
+    en   = MATRIX(N, 1)          # energy of the grid points
+    dosa = np.zeros((N, nproj))  # dosa[i, proj] - dos for level i projected on projection proj, alpha spin-orbitals
+    dosb = np.zeros((N, nproj))  # same, for beta spin-orbitals
     for i in range(0,N):
         en.set(i, 0, emin + i*de - Ef)
 
         #============= Data gathering  =================
 
-    for proj in projections:  # loop over all projection
+    # List the existing projection files once and index them by their labels,
+    # rather than probing the filesystem for every possible combination of
+    # (atom, element, wfc, angular momentum, j)
+    pat = re.compile(r'^'+re.escape(prefix)+r'(\d+)\(([A-Za-z]+)\)_wfc#(\d+)\(([a-z]+)(?:_j([\d.]+))?\)$')
+
+    files = {}
+    for filename in glob.glob(prefix+"*"):
+        m = pat.match(filename)
+        if m:
+            a, Elt, wfc, symb, k = m.groups()
+            files[ (int(a), Elt, int(wfc), symb, (float(k) if k != None else None)) ] = filename
+
+    tasks = []   # the (filename, proj_indx) pairs to process
+
+    for proj_indx, proj in enumerate(projections):  # loop over all projection
         ang_mom = proj[0]
         atoms = proj[1]
         elements = proj[2]
 
-        proj_indx = projections.index(proj)
-
         for a in atoms: # open files for atoms with given indices (indexing from 1)
             for symb in ang_mom:  # for given angular momentum labels
-                for wfc in range(0,5): # Specify max wfc type index - usually no more than 3, 5 - should be more than enough  
+                for wfc in range(0,5): # Specify max wfc type index - usually no more than 3, 5 - should be more than enough
                     for Elt in elements: # for given atom names
 
                         if nspin == 4:
                             for k in [0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0]: # total angular momentum label
-                                filename = prefix+str(a)+"("+Elt+")_wfc#"+str(wfc)+"("+symb+"_j"+str(k)+")"
-                                if os.path.exists(filename):
-
-                                    fa = open(filename,"r")
-                                    B = fa.readlines()
-                                    check = B[0].split()
-                                    fa.close()
-
-                                    for lin in B[1:]:  # read all lines, except for the header
-                                        tmp = lin.split()
-                                        e = float(tmp[0])
-                                        if e<emin or e>emax:
-                                            pass
-                                        else:
-                                            state_indx = int(math.floor((e - emin)/de))
-                                            dosa.add(state_indx, proj_indx, float(tmp[1]))
+                                filename = files.get( (a, Elt, wfc, symb, k) )
+                                if filename != None:
+                                    tasks.append( (filename, proj_indx) )
 
                         else:
+                            filename = files.get( (a, Elt, wfc, symb, None) )
+                            if filename != None:
+                                tasks.append( (filename, proj_indx) )
 
-                            filename = prefix+str(a)+"("+Elt+")_wfc#"+str(wfc)+"("+symb+")"  # file 
-                            if os.path.exists(filename):
+    # Each file contributes to the histograms independently, so the parsing can
+    # be farmed out to a process pool; the accumulation stays on this process
+    fnames = [filename for filename, proj_indx in tasks]
 
-                                fa = open(filename,"r")
-                                B = fa.readlines()
-                                check = B[0].split()
-                                fa.close()
+    if nprocs > 1:
+        import concurrent.futures
+        from itertools import repeat
 
-                                for lin in B[1:]:  # read all lines, except for the header
-                                    tmp = lin.split()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=nprocs) as pool:
+            file_dos = list( pool.map(_QE_pdos_file, fnames, repeat(emin), repeat(emax),
+                                      repeat(de), repeat(N), repeat(nspin)) )
+    else:
+        file_dos = [ _QE_pdos_file(filename, emin, emax, de, N, nspin) for filename in fnames ]
 
-                                    e = float(tmp[0])
-                                    if e<emin or e>emax:
-                                        pass
-                                    else:
-                                        state_indx = int(math.floor((e - emin)/de))
-                                        dosa.add(state_indx, proj_indx, float(tmp[1]))
-                                        if nspin == 2 and check[4] == "ldosdw(E)":
-                                            dosb.add(state_indx, proj_indx, float(tmp[2]))
+    for (filename, proj_indx), (dos_a, dos_b) in zip(tasks, file_dos):
+        dosa[:, proj_indx] += dos_a
+        if dos_b is not None:
+            dosb[:, proj_indx] += dos_b
 
     #============= Optional convolution =================
 
-    E, pDOSa, pDOSb = en, dosa, dosb
+    E, pDOSa, pDOSb = en, data_conv.nparray2MATRIX(dosa), data_conv.nparray2MATRIX(dosb)
     if do_convolve==True:
-        E, pDOSa = convolve(en, dosa, de, de_new, var)
-        E, pDOSb = convolve(en, dosb, de, de_new, var)
+        E, pDOSa = convolve(en, pDOSa, de, de_new, var)
+        E, pDOSb = convolve(en, pDOSb, de, de_new, var)
 
     #============= Print out ==================
-    f2a = open(outfile_prefix+"_alp.txt","w"); f2a.close()
-    f2b = open(outfile_prefix+"_bet.txt","w"); f2b.close()
-
-    N = E.num_of_rows
-    for i in range(0,N):  # loop over grid points
-        line = str(E.get(i,0))+"   "
-        tot = 0.0
-        for j in range(0,nproj):
-            tot = tot + pDOSa.get(i,j)
-            line = line + str(pDOSa.get(i,j))+"   "
-        line = line + str(tot)+"\n"
-        f2a = open(outfile_prefix+"_alp.txt","a")
-        f2a.write(line)
-        f2a.close()
-
-    for i in range(0,N):  # loop over grid points
-        line = str(E.get(i,0))+"   "
-        tot = 0.0
-        for j in range(0,nproj):
-            tot = tot + pDOSb.get(i,j)
-            line = line + str(pDOSb.get(i,j))+"   "
-        line = line + str(tot)+"\n"
-        f2b = open(outfile_prefix+"_bet.txt","a")
-        f2b.write(line)
-        f2b.close()
-
+    # Columns are: the energy grid, each of the projections, and their sum.
+    # Each file is written with a single buffered call rather than being
+    # re-opened and appended to for every grid point
+    E_np = data_conv.MATRIX2nparray(E)[:, 0]
+    pa = data_conv.MATRIX2nparray(pDOSa)
+    pb = data_conv.MATRIX2nparray(pDOSb)
+
+    np.savetxt(outfile_prefix+"_alp.txt", np.column_stack((E_np, pa, pa.sum(axis=1))), fmt="%.17g")
+    np.savetxt(outfile_prefix+"_bet.txt", np.column_stack((E_np, pb, pb.sum(axis=1))), fmt="%.17g")
+
+    # Only nspin = 2 has a meaningful beta channel - do not spend an N x nproj
+    # copy on duplicating the alpha one for the other cases
     if nspin == 2:
         return E, pDOSa, pDOSb
     else:
-        pDOSb = MATRIX(pDOSa)
-        return E, pDOSa, pDOSb
+        return E, pDOSa, None
 
 
 
@@ -270,9 +468,16 @@ def libra_pdos(_emin, _emax, _de, projections, prefix, outfile, Nel, do_convolve
             
         * _de_new ( double ): new energy grid (for convolved) spacing  [eV]
         
-        * _var ( double ): the width of the Gaussian used to broaden each energy grid point [eV] 
-        
-        
+        * _var ( double ): the width of the Gaussian used to broaden each energy grid point [eV]
+
+    Returns:
+        np.array( N, nproj+2 ): the computed pDOS table - the energy grid, each of
+            the projections, and their sum; the same table is written to `outfile`
+            below the Fermi-energy header. With do_convolve == True, N is the size
+            of the convolved grid (the original number of points times
+            int(_de/_de_new)) and the table covers all of it - earlier versions
+            truncated the output to the first original-grid-size rows.
+
     # Example: of call - for Si QD
     # Si
     #main(-35.0, 35.0, 0.1,[["tot",range(0,103)]],"_alpha_wfc_atom","dos_proj.txt",238)   
@@ -291,49 +496,38 @@ def libra_pdos(_emin, _emax, _de, projections, prefix, outfile, Nel, do_convolve
     N = int(math.floor((emax - emin)/de))+1 # number of the gridpoints
 
     en0 = []
-    dosa = MATRIX(N, nproj)  # Matrix for alpha spin-orbitals dos.get(i,proj) - dos for level i projected on projection proj
-    dosb = MATRIX(N, nproj)  # Matrix for beta  spin-orbitals
+    dosa = np.zeros((N, nproj))  # dosa[i, proj] - dos for level i projected on projection proj, alpha spin-orbitals
+    dosb = np.zeros((N, nproj))  # same, for beta spin-orbitals
     
     
-    for proj in projections:  # loop over all projection
+    for proj_indx, proj in enumerate(projections):  # loop over all projection
         ang_mom = proj[0]
         atoms = proj[1]
 
-        proj_indx = projections.index(proj)
-                                            
+        # which column of the file holds a given projection
+        ang_mom_col = {"tot":1, "s":2, "p":3, "d":4}
+
         for a in atoms: # open files for all atoms in given group
             fa = open(prefix+str(a),"r")
             B = fa.readlines()
             fa.close()
 
-            for lin in B[1:-4]:  # read all lines
-                tmp = lin.split()
-                 
-                e = float(tmp[0]) # energy in Ha
-                if a==0:
-                    en0.append(e)  
-                
-                x = 0.0
-                if ang_mom=="s":
-                    x = float(tmp[2])
-                elif ang_mom=="p":
-                    x = float(tmp[3])
-                elif ang_mom=="d":
-                    x = float(tmp[4])
-                elif ang_mom=="tot":
-                    x = float(tmp[1])
-                else:
-                    x = 0.0
-
-                if e<emin or e>emax:
-                    pass
-                else:
-                    grid_indx = int(math.floor((e - emin)/de))  # grid point
-                    dosa.add(grid_indx, proj_indx, x)
-                    dosb.add(grid_indx, proj_indx, x)
+            data = np.loadtxt(B[1:-4], ndmin=2)  # all lines, except for the header and the footer
 
+            e = data[:, 0]   # energy in Ha
+            if a==0:
+                en0 = en0 + e.tolist()
+
+            if ang_mom in ang_mom_col:
+                x = _bin_add(e, data[:, ang_mom_col[ang_mom]], emin, emax, de, N)
+                dosa[:, proj_indx] += x
+                dosb[:, proj_indx] += x
+
+
+    # Back to MATRIX only at the boundary with the rest of the workflow
+    dosa = data_conv.nparray2MATRIX(dosa)
+    dosb = data_conv.nparray2MATRIX(dosb)
 
-    
     etol = 1e-10
     kT = 0.1 * units.ev2Ha # some reasonable parameters
     Ef = fermi_energy(en0, Nel,2.0, kT, etol)  # Fermi energy in Ha
@@ -355,33 +549,18 @@ def libra_pdos(_emin, _emax, _de, projections, prefix, outfile, Nel, do_convolve
     E *= (1.0/units.ev2Ha)
 
         
+    # Pull the results out as whole arrays - this matches the row-major storage
+    # and avoids a Python-level get() call per matrix element
+    E_np = data_conv.MATRIX2nparray(E)[:, 0]
+    pa = data_conv.MATRIX2nparray(pDOSa)
+
+    res = np.column_stack( (E_np, pa, pa.sum(axis=1)) )   # E, the projections, and their total
+
     f2 = open(outfile,"w")
     f2.write("Ef = %5.3f eV\n" % (Ef / units.ev2Ha) )
+    np.savetxt(f2, res, fmt="%.17g")
     f2.close()
 
-    
-    res = np.zeros( (N, nproj+2), dtype=float)
-    
-    # Now compute projections
-    for i in range(0,N):  # loop energy grid
-
-        res[i, 0] = E.get(i,0) 
-        line = str(E.get(i,0))+"   "
-
-        tot = 0.0
-        for j in range(0,nproj):
-            res[i, j+1] = pDOSa.get(i,j)
-            tot = tot + pDOSa.get(i,j)
-            line = line + str(pDOSa.get(i,j))+"   "
-            
-        res[i, nproj+1] = tot
-        line = line + str(tot)+"\n"
-
-        f2 = open(outfile,"a")
-        f2.write(line)
-        f2.close()
-    
-
     return res
     
         
\ No newline at end of file